@@ -0,0 +1,20 @@
+import multiprocessing
+import os
+
+# Uso: gunicorn -c gunicorn.conf.py
+wsgi_app = 'server:app'
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8080')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# El límite de intentos de login (5/minuto) se cuenta en RATELIMIT_STORAGE_URI. Con memory://
+# cada worker lleva su propio contador y el límite real se multiplica por el número de workers,
+# así que con más de un worker hace falta un almacenamiento compartido
+# (p. ej. RATELIMIT_STORAGE_URI=redis://localhost:6379, requiere el paquete redis).
+if workers > 1 and os.getenv('RATELIMIT_STORAGE_URI', 'memory://').startswith('memory://'):
+    raise RuntimeError("Con GUNICORN_WORKERS > 1 hay que definir RATELIMIT_STORAGE_URI "
+                       "con un almacenamiento compartido (p. ej. redis://).")
+
+# Hilos reales: os.scandir y el hash de contraseñas bloquean igual con gevent.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = 60
@@ -1,20 +1,56 @@
+import functools
+import hashlib
+import heapq
+import json
 import os
-from datetime import datetime, timedelta
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import quote
+import click
+import orjson
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from dotenv import load_dotenv
-from flask import (Flask, render_template, request, send_from_directory, abort,
-                   url_for, redirect, flash)
+from flask import (Flask, Response, render_template, request, send_from_directory,
+                   abort, url_for, redirect, flash, make_response)
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
 from flask_login import (LoginManager, UserMixin, login_user, logout_user,
                        login_required, current_user)
 from flask_wtf import FlaskForm
+from PIL import Image
 from wtforms import StringField, PasswordField, BooleanField, SubmitField
 from wtforms.validators import DataRequired
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import check_password_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows (waitress): un solo proceso, basta con _manifest_lock.
+    fcntl = None
 
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key-for-dev')
 app.config['BASE_PATH'] = os.getenv('IMAGE_BASE_PATH', 'imagenes')
+app.config['BASE_PATH_RESOLVED'] = Path(app.config['BASE_PATH']).resolve()
+app.config['BASE_PATH_ABS'] = str(app.config['BASE_PATH_RESOLVED'])
+app.config['LISTING_CACHE_TTL'] = int(os.getenv('LISTING_CACHE_TTL', '30'))
+app.config['LISTING_CACHE_SIZE'] = 512
+app.config['THUMB_SIZE'] = (320, 320)
+app.config['X_ACCEL_PREFIX'] = os.getenv('X_ACCEL_PREFIX')
+app.config['TRUSTED_PROXIES'] = int(os.getenv('TRUSTED_PROXIES', '0'))
+
+if app.config['TRUSTED_PROXIES']:
+    # Detrás de nginx, remote_addr sería siempre el proxy y el límite de login sería global.
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                            x_proto=app.config['TRUSTED_PROXIES'])
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -22,11 +58,19 @@ login_manager.login_view = 'login'
 login_manager.login_message = "Por favor, inicie sesión para acceder a esta página."
 login_manager.login_message_category = "danger"
 
+limiter = Limiter(get_remote_address, app=app,
+                  storage_uri=os.getenv('RATELIMIT_STORAGE_URI', 'memory://'))
+
 @app.context_processor
 def inject_year():
     return {'current_year': datetime.utcnow().year}
 
 
+password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=1)
+# Limita cuántas verificaciones de contraseña corren a la vez durante una ráfaga de intentos.
+_password_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='password')
+
+
 class User(UserMixin):
     def __init__(self, id, username, password_hash):
         self.id = id
@@ -35,10 +79,22 @@ class User(UserMixin):
 
     @staticmethod
     def set_password(password):
-        return generate_password_hash(password)
+        return password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return _password_executor.submit(self._verify_password, password).result()
+
+    def _verify_password(self, password):
+        if not self.password_hash.startswith('$argon2'):
+            if not check_password_hash(self.password_hash, password): return False
+            self.password_hash = self.set_password(password)
+            return True
+        try:
+            password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError): return False
+        if password_hasher.check_needs_rehash(self.password_hash):
+            self.password_hash = self.set_password(password)
+        return True
 
 admin_username = os.getenv('ADMIN_USERNAME')
 admin_password = os.getenv('ADMIN_PASSWORD')
@@ -50,9 +106,10 @@ users_db = {
     "1": User(
         id="1",
         username=admin_username,
-        password_hash=generate_password_hash(admin_password)
+        password_hash=User.set_password(admin_password)
     )
 }
+users_by_username = {u.username: u for u in users_db.values()}
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -67,13 +124,14 @@ class LoginForm(FlaskForm):
 
 
 @app.route('/login', methods=['GET', 'POST'])
+@limiter.limit("5/minute", methods=['POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     
     form = LoginForm()
     if form.validate_on_submit():
-        user = next((u for u in users_db.values() if u.username == form.username.data), None)
+        user = users_by_username.get(form.username.data)
         if user and user.check_password(form.password.data):
             login_user(user, remember=form.remember_me.data)
             return redirect(url_for('index'))
@@ -83,51 +141,111 @@ def login():
     
     return render_template('login.html', form=form)
 
+@app.errorhandler(429)
+def too_many_login_attempts(e):
+    flash('Demasiados intentos de inicio de sesión. Intente de nuevo en un minuto.')
+    return render_template('login.html', form=LoginForm()), 429
+
 @app.route('/logout')
 @login_required
 def logout():
     logout_user()
     return redirect(url_for('login'))
 
+def _code_version():
+    # Cambia con cada despliegue que toque las plantillas o este módulo.
+    digest = hashlib.blake2b(digest_size=8)
+    template_dir = Path(app.root_path, app.template_folder)
+    for path in sorted(template_dir.glob('*.html')) + [Path(__file__)]:
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+app.config['CODE_VERSION'] = _code_version()
+
+def _page_etag(*parts):
+    # La página también depende del usuario (se muestra su nombre), del año del pie y del código.
+    key = '|'.join(str(p) for p in (current_user.get_id(), datetime.utcnow().year,
+                                    app.config['CODE_VERSION'], *parts))
+    return hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+
+def _not_modified(etag):
+    resp = Response(status=304)
+    resp.set_etag(etag)
+    return resp
+
+def _conditional_page(html, etag, mtime_ns):
+    resp = make_response(html)
+    resp.set_etag(etag)
+    resp.last_modified = datetime.fromtimestamp(mtime_ns / 1e9, timezone.utc)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
+
+_DAY_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+def _check_day(day):
+    if not _DAY_RE.fullmatch(day): abort(404)
+
+@functools.lru_cache(maxsize=4096)
+def _display_day(day):
+    return f"{day[8:10]}/{day[5:7]}/{day[0:4]}"
+
 @app.route("/")
 @login_required
 def index():
-    weeks = group_by_weeks()
-    return render_template('index.html', weeks=weeks)
+    try:
+        manifest = _weeks_manifest(app.config['BASE_PATH_ABS'])
+    except FileNotFoundError:
+        return render_template('index.html', weeks={})
+    mtime = manifest['stamps']['.']
+    etag = _page_etag(mtime)
+    if request.if_none_match.contains(etag): return _not_modified(etag)
+    return _conditional_page(render_template('index.html', weeks=manifest['weeks']), etag, mtime)
 
 @app.route("/day/<day>")
 @login_required
 def show_day(day):
-    day_path = os.path.join(app.config['BASE_PATH'], day)
-    if not os.path.exists(day_path): abort(404)
-    display_day = datetime.strptime(day, "%Y-%m-%d").strftime('%d/%m/%Y')
-    hours_with_data = get_hour_data(day_path)
-    return render_template('day.html', day=day, display_day=display_day, hours=hours_with_data)
+    _check_day(day)
+    day_path = os.path.join(app.config['BASE_PATH_ABS'], day)
+    try:
+        manifest = _day_manifest(day_path)
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404)
+    display_day = _display_day(day)
+    etag = _page_etag(json.dumps(manifest['hours'], sort_keys=True))
+    if request.if_none_match.contains(etag): return _not_modified(etag)
+    html = render_template('day.html', day=day, display_day=display_day, hours=manifest['hours'])
+    return _conditional_page(html, etag, manifest['built'])
+
+_TIME_RE = re.compile(r'(\d+)m(\d+)s')
+
+@app.template_filter('capture_time')
+def _format_time(filename):
+    m = _TIME_RE.match(filename)
+    if m is None: return os.path.splitext(filename)[0]
+    return f"{m[1]}m {m[2]}s"
 
 @app.route("/day/<day>/hour/<hour>")
 @login_required
 def show_hour(day, hour):
-    hour_path = os.path.join(app.config['BASE_PATH'], day, hour, "normal")
-    if not os.path.exists(hour_path): abort(404)
-    
-    page = request.args.get('page', 1, type=int)
+    _check_day(day)
+    page = max(request.args.get('page', 1, type=int), 1)
     IMAGES_PER_PAGE = 25
-    all_images = sorted([f for f in os.listdir(hour_path) if f.lower().endswith('.jpg')])
-    total_images = len(all_images)
     start_index = (page - 1) * IMAGES_PER_PAGE
     end_index = start_index + IMAGES_PER_PAGE
-    images_on_page = all_images[start_index:end_index]
+    try:
+        images_on_page, total_images = _hour_images_page(day, hour, start_index, end_index)
+    except (FileNotFoundError, NotADirectoryError):
+        abort(404)
     total_pages = (total_images + IMAGES_PER_PAGE - 1) // IMAGES_PER_PAGE
 
     time_range = ""
     if images_on_page:
-        def format_time(filename):
-            return os.path.splitext(filename)[0].replace("m", "m ").replace("s", "s")
-        first_time = format_time(images_on_page[0])
-        last_time = format_time(images_on_page[-1])
+        first_time = _format_time(images_on_page[0])
+        last_time = _format_time(images_on_page[-1])
         time_range = f"({first_time} - {last_time})"
 
-    display_day = datetime.strptime(day, "%Y-%m-%d").strftime('%d/%m/%Y')
+    display_day = _display_day(day)
     
     return render_template(
         'hour.html', 
@@ -141,88 +259,349 @@ def show_hour(day, hour):
         IMAGES_PER_PAGE=IMAGES_PER_PAGE
     )
 
+def _send_image(target):
+    prefix = app.config['X_ACCEL_PREFIX']
+    if not prefix:
+        return send_from_directory(target.parent, target.name, conditional=True)
+    rel_path = target.relative_to(app.config['BASE_PATH_RESOLVED']).as_posix()
+    return Response(headers={'X-Accel-Redirect': f"{prefix.rstrip('/')}/{quote(rel_path)}",
+                             'Content-Type': ''})
+
+def _safe_path(filepath):
+    base_path = app.config['BASE_PATH_ABS']
+    safe_path = os.path.normpath(os.path.join(base_path, filepath))
+    if not safe_path.startswith(base_path + os.sep): abort(404)
+    return safe_path
+
+def _resolve_file(path):
+    # Sigue los enlaces simbólicos: el archivo real también debe quedar dentro de BASE_PATH.
+    try:
+        target = _resolve_image(path)
+    except (OSError, RuntimeError):
+        abort(404)
+    if not target.is_relative_to(app.config['BASE_PATH_RESOLVED']) or not target.is_file(): abort(404)
+    return target
+
 @app.route("/images/<path:filepath>")
 @login_required
 def serve_image_path(filepath):
-    safe_path = os.path.abspath(os.path.join(app.config['BASE_PATH'], filepath))
-    if not safe_path.startswith(os.path.abspath(app.config['BASE_PATH'])): abort(404)
-    directory, filename = os.path.split(safe_path)
-    return send_from_directory(directory, filename)
+    safe_path = _safe_path(filepath)
+    return _send_image(_resolve_file(safe_path))
+
+THUMBS_DIR = 'thumbs'
+
+def generate_thumb(src_path, thumb_path, size):
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    tmp_path = f"{thumb_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with Image.open(src_path) as img:
+            img.thumbnail(size)
+            if img.mode not in ('RGB', 'RGBA'): img = img.convert('RGB')
+            img.save(tmp_path, 'WEBP', quality=75, method=6)
+        os.replace(tmp_path, thumb_path)
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
+def _thumb_paths(hour_dir, filename):
+    src_path = os.path.join(hour_dir, "normal", filename)
+    thumb_path = os.path.join(hour_dir, THUMBS_DIR, shard_name(filename),
+                              os.path.splitext(filename)[0] + '.webp')
+    return src_path, thumb_path
+
+def _ensure_thumb(src_path, thumb_path):
+    src_mtime = os.stat(src_path).st_mtime_ns
+    try:
+        if os.stat(thumb_path).st_mtime_ns >= src_mtime: return
+    except FileNotFoundError: pass
+    generate_thumb(src_path, thumb_path, app.config['THUMB_SIZE'])
+
+@app.route("/thumb/<path:filepath>")
+@login_required
+def serve_thumb(filepath):
+    safe_path = _safe_path(filepath)
+    hour_dir, filename = os.path.split(safe_path)
+    src_path, thumb_path = _thumb_paths(hour_dir, filename)
+    src = _resolve_file(src_path)
+    try:
+        _ensure_thumb(src, thumb_path)
+    except (OSError, Image.DecompressionBombError):
+        return _send_image(src)
+    return _send_image(_resolve_file(thumb_path))
 
 @app.route("/api/images/<day>/<hour>")
 @login_required
 def get_images_for_hour(day, hour):
-    hour_path = os.path.join(app.config['BASE_PATH'], day, hour, "normal")
-    if not os.path.exists(hour_path):
-        return abort(404)
-
-    page = request.args.get('page', 1, type=int)
+    _check_day(day)
+    page = max(request.args.get('page', 1, type=int), 1)
     IMAGES_PER_PAGE = 25
 
-    all_images = sorted([f for f in os.listdir(hour_path) if f.lower().endswith('.jpg')])
-    total_images = len(all_images)
-    
     start_index = (page - 1) * IMAGES_PER_PAGE
     end_index = start_index + IMAGES_PER_PAGE
-    images_on_page = all_images[start_index:end_index]
+    try:
+        images_on_page, total_images = _hour_images_page(day, hour, start_index, end_index)
+    except (FileNotFoundError, NotADirectoryError):
+        return abort(404)
 
     total_pages = (total_images + IMAGES_PER_PAGE - 1) // IMAGES_PER_PAGE
 
-    return {
+    return Response(orjson.dumps({
         "images": images_on_page,
         "currentPage": page,
         "totalPages": total_pages
-    }
-
-
-
-def group_by_weeks():
-    base_path = app.config['BASE_PATH']
-    if not os.path.exists(base_path): return {}
-    items = sorted(os.listdir(base_path), reverse=True)
+    }), mimetype='application/json')
+
+
+SHARD_NAMES = frozenset(f"{i:02x}" for i in range(256))
+
+def shard_name(filename):
+    return f"{zlib.crc32(filename.encode()) & 0xff:02x}"
+
+def shard_path(normal_path, filename):
+    return os.path.join(normal_path, shard_name(filename), filename)
+
+def store_image(normal_path, src_path):
+    # Tocar normal/ hace que las cachés vean la captura al momento, sin esperar a su TTL.
+    target = shard_path(normal_path, os.path.basename(src_path))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(src_path, target)
+    os.utime(normal_path)
+    return target
+
+def _resolve_image(path):
+    # Las imágenes pueden estar directamente en normal/ o en normal/<shard>/.
+    try:
+        return Path(path).resolve(strict=True)
+    except FileNotFoundError:
+        directory, filename = os.path.split(path)
+        if os.path.basename(directory) != "normal": raise
+        return Path(shard_path(directory, filename)).resolve(strict=True)
+
+def _scan_normal(normal_path):
+    names = []
+    mtime = os.stat(normal_path).st_mtime_ns
+    with os.scandir(normal_path) as it:
+        for e in it:
+            if e.name in SHARD_NAMES and e.is_dir(follow_symlinks=False):
+                with os.scandir(e.path) as bucket:
+                    names.extend(b.name for b in bucket if b.name.lower().endswith('.jpg'))
+            elif e.name.lower().endswith('.jpg'):
+                names.append(e.name)
+    return names, mtime
+
+def _stamps_fresh(base_dir, stamps):
+    try:
+        return all(os.stat(f"{base_dir}/{rel_path}").st_mtime_ns == mtime
+                   for rel_path, mtime in stamps.items())
+    except OSError: return False
+
+_hour_listing_cache = {}
+_hour_listing_lock = threading.Lock()
+
+def _hour_listing(day, hour):
+    hour_path = os.path.join(app.config['BASE_PATH_ABS'], day, hour, "normal")
+    now = time.monotonic()
+    key = (day, hour)
+    with _hour_listing_lock:
+        cached = _hour_listing_cache.get(key)
+    if cached and cached['expires'] > now and _stamps_fresh(hour_path, cached['stamps']):
+        return cached
+
+    names, mtime = _scan_normal(hour_path)
+    listing = {'stamps': {'.': mtime}, 'expires': now + app.config['LISTING_CACHE_TTL'],
+               'names': tuple(names), 'ordered': ()}
+
+    with _hour_listing_lock:
+        _hour_listing_cache.pop(key, None)
+        _hour_listing_cache[key] = listing
+        while len(_hour_listing_cache) > app.config['LISTING_CACHE_SIZE']:
+            del _hour_listing_cache[next(iter(_hour_listing_cache))]
+    return listing
+
+def _hour_images_page(day, hour, start_index, end_index):
+    listing = _hour_listing(day, hour)
+    names = listing['names']
+    ordered = listing['ordered']
+    if len(ordered) < min(end_index, len(names)):
+        # Solo se ordenan los nombres hasta la página pedida; las páginas profundas ordenan todo.
+        if end_index * 2 >= len(names):
+            ordered = tuple(sorted(names))
+        else:
+            ordered = tuple(heapq.nsmallest(end_index, names))
+        with _hour_listing_lock:
+            if len(ordered) > len(listing['ordered']):
+                listing['ordered'] = ordered
+    return ordered[start_index:end_index], len(names)
+
+MANIFEST_NAME = '_manifest.json'
+WEEKS_MANIFEST_NAME = '_weeks.json'
+_manifest_lock = threading.Lock()
+
+def _reserve_manifest(manifest_path):
+    # Crear el archivo antes de leer el mtime del directorio para que escribirlo no lo invalide.
+    try: open(manifest_path, 'a').close()
+    except OSError: pass
+
+def _lock_manifest(f, exclusive):
+    # El archivo se reescribe en su sitio (un archivo temporal cambiaría el mtime del
+    # directorio), así que lectores y escritores de otros workers se coordinan con flock.
+    if fcntl is not None: fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+def _read_manifest(base_dir, manifest_path, ttl=None):
+    try:
+        with open(manifest_path) as f:
+            _lock_manifest(f, exclusive=False)
+            manifest = json.load(f)
+        if ttl is not None and time.time_ns() - manifest['built'] > ttl * 10**9: return None
+        return manifest if _stamps_fresh(base_dir, manifest['stamps']) else None
+    except (OSError, ValueError, KeyError, AttributeError, TypeError): return None
+
+def _write_manifest(manifest_path, manifest):
+    try:
+        with _manifest_lock, open(manifest_path, 'r+') as f:
+            _lock_manifest(f, exclusive=True)
+            f.seek(0)
+            f.truncate()
+            json.dump(manifest, f)
+    except OSError: pass
+
+@functools.lru_cache(maxsize=4096)
+def _week_entry(name):
+    try:
+        date = datetime.strptime(name, "%Y-%m-%d")
+    except ValueError: return None
+    monday = date - timedelta(days=date.weekday())
+    sunday = monday + timedelta(days=6)
+    week_label = f"{monday.strftime('%d/%m/%Y')} - {sunday.strftime('%d/%m/%Y')}"
+    return week_label, date.strftime('%d/%m/%Y')
+
+def build_weeks_manifest(base_path):
+    manifest_path = os.path.join(base_path, WEEKS_MANIFEST_NAME)
+    _reserve_manifest(manifest_path)
+    stamps = {'.': os.stat(base_path).st_mtime_ns}
+    with os.scandir(base_path) as it:
+        items = sorted([e.name for e in it if e.is_dir(follow_symlinks=False)], reverse=True)
     weeks = {}
     for item in items:
-        if os.path.isdir(os.path.join(base_path, item)):
-            try:
-                date = datetime.strptime(item, "%Y-%m-%d")
-                monday = date - timedelta(days=date.weekday())
-                sunday = monday + timedelta(days=6)
-                week_label = f"{monday.strftime('%d/%m/%Y')} - {sunday.strftime('%d/%m/%Y')}"
-                if week_label not in weeks: weeks[week_label] = []
-                weeks[week_label].append({'path': item, 'display': date.strftime('%d/%m/%Y')})
-            except ValueError: continue
-    return weeks
+        entry = _week_entry(item)
+        if entry is None: continue
+        week_label, display = entry
+        if week_label not in weeks: weeks[week_label] = []
+        weeks[week_label].append({'path': item, 'display': display})
+    manifest = {'stamps': stamps, 'weeks': weeks}
+    _write_manifest(manifest_path, manifest)
+    return manifest
+
+def _weeks_manifest(base_path):
+    return (_read_manifest(base_path, os.path.join(base_path, WEEKS_MANIFEST_NAME))
+            or build_weeks_manifest(base_path))
 
-def get_hour_data(day_path):
-    hour_data = []
-    if not os.path.isdir(day_path): return hour_data
-    
-    def sort_key(hour_str):
+def group_by_weeks():
+    return _weeks_manifest(app.config['BASE_PATH_ABS'])['weeks']
+
+def _hour_sort_key(hour_str):
+    try:
+        parts = hour_str.lower().split("_")
+        hour_num = int(parts[0])
+        ampm = parts[1] if len(parts) > 1 else "am"
+        if ampm == "pm" and hour_num != 12: hour_num += 12
+        if ampm == "am" and hour_num == 12: hour_num = 0
+        return hour_num
+    except Exception: return 99
+
+def build_manifest(day_path):
+    manifest_path = os.path.join(day_path, MANIFEST_NAME)
+    _reserve_manifest(manifest_path)
+    stamps = {'.': os.stat(day_path).st_mtime_ns}
+    with os.scandir(day_path) as it:
+        hour_entries = sorted([e for e in it if e.is_dir(follow_symlinks=False)],
+                              key=lambda e: _hour_sort_key(e.name))
+
+    hours = []
+    for entry in hour_entries:
+        hour = entry.name
         try:
-            parts = hour_str.lower().split("_")
-            hour_num = int(parts[0])
-            ampm = parts[1] if len(parts) > 1 else "am"
-            if ampm == "pm" and hour_num != 12: hour_num += 12
-            if ampm == "am" and hour_num == 12: hour_num = 0
-            return hour_num
-        except Exception: return 99
-    
-    sorted_hours = sorted(os.listdir(day_path), key=sort_key)
-
-    for hour in sorted_hours:
-        hour_path = os.path.join(day_path, hour)
-        if os.path.isdir(hour_path):
-            normal_path = os.path.join(hour_path, "normal")
-            if os.path.isdir(normal_path):
-                images = sorted([f for f in os.listdir(normal_path) if f.lower().endswith('.jpg')])
-                thumbnail = images[0] if images else None
-                hour_data.append({"hour": hour, "thumbnail": thumbnail})
-    return hour_data
+            names, stamps[f"{hour}/normal"] = _scan_normal(f"{entry.path}/normal")
+        except (FileNotFoundError, NotADirectoryError):
+            stamps[hour] = entry.stat(follow_symlinks=False).st_mtime_ns
+            continue
+        hours.append({"hour": hour, "thumbnail": min(names, default=None), "count": len(names)})
+    manifest = {'stamps': stamps, 'built': time.time_ns(), 'hours': hours}
+    _write_manifest(manifest_path, manifest)
+    return manifest
+
+def _day_manifest(day_path):
+    # Solo se vigila normal/ de cada hora: los cambios dentro de las subcarpetas por hash
+    # que no pasan por store_image() se ven al caducar el manifiesto.
+    return (_read_manifest(day_path, os.path.join(day_path, MANIFEST_NAME),
+                           ttl=app.config['LISTING_CACHE_TTL'])
+            or build_manifest(day_path))
 
+def get_hour_data(day_path):
+    try:
+        return _day_manifest(day_path)['hours']
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+def _cli_weeks(rebuild=False):
+    base_path = app.config['BASE_PATH_ABS']
+    try:
+        manifest = build_weeks_manifest(base_path) if rebuild else _weeks_manifest(base_path)
+    except FileNotFoundError:
+        raise click.ClickException(f"No existe la carpeta de imágenes {base_path}.")
+    return manifest['weeks']
+
+@app.cli.command('build-manifests')
+def build_manifests_command():
+    """Genera los manifiestos de semanas y de cada día en BASE_PATH."""
+    base_path = app.config['BASE_PATH_ABS']
+    weeks = _cli_weeks(rebuild=True)
+    total_days = 0
+    for days in weeks.values():
+        for day in days:
+            build_manifest(os.path.join(base_path, day['path']))
+            total_days += 1
+    click.echo(f"Manifiestos generados para {total_days} días.")
+
+@app.cli.command('build-thumbs')
+def build_thumbs_command():
+    """Genera las miniaturas que falten o estén desactualizadas en BASE_PATH."""
+    base_path = app.config['BASE_PATH_ABS']
+    total_thumbs = 0
+    for days in _cli_weeks().values():
+        for day in days:
+            day_path = os.path.join(base_path, day['path'])
+            for hour_data in get_hour_data(day_path):
+                hour_dir = os.path.join(day_path, hour_data['hour'])
+                images, _ = _scan_normal(os.path.join(hour_dir, "normal"))
+                for filename in images:
+                    try:
+                        src_path, thumb_path = _thumb_paths(hour_dir, filename)
+                        _ensure_thumb(_resolve_image(src_path), thumb_path)
+                        total_thumbs += 1
+                    except (OSError, Image.DecompressionBombError) as e:
+                        click.echo(f"No se pudo generar la miniatura de {filename}: {e}", err=True)
+    click.echo(f"Miniaturas verificadas: {total_thumbs}.")
+
+@app.cli.command('shard-images')
+def shard_images_command():
+    """Mueve las imágenes sueltas de cada carpeta normal/ a su subcarpeta por hash."""
+    base_path = app.config['BASE_PATH_ABS']
+    total_moved = 0
+    for days in _cli_weeks().values():
+        for day in days:
+            day_path = os.path.join(base_path, day['path'])
+            for hour_data in get_hour_data(day_path):
+                normal_path = os.path.join(day_path, hour_data['hour'], "normal")
+                with os.scandir(normal_path) as it:
+                    loose = [e.name for e in it if e.is_file() and e.name.lower().endswith('.jpg')]
+                for filename in loose:
+                    store_image(normal_path, os.path.join(normal_path, filename))
+                    total_moved += 1
+    click.echo(f"Imágenes movidas: {total_moved}.")
 
 if __name__ == "__main__":
-    if not os.path.exists(app.config['BASE_PATH']):
-        os.makedirs(app.config['BASE_PATH'])
+    if not os.path.exists(app.config['BASE_PATH_ABS']):
+        os.makedirs(app.config['BASE_PATH_ABS'])
     
     is_debug = os.getenv('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
     app.run(host="0.0.0.0", port=8080)
\ No newline at end of file